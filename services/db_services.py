@@ -9,6 +9,7 @@ engine = create_engine(
     "sqlite:///ToDoDB.db",
     connect_args={"check_same_thread": False},
     echo=True,
+    query_cache_size=1200,
 )
 create_database(engine.url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -1,7 +1,26 @@
-from typing import Type
-
-from sqlalchemy import asc, desc, and_, select, func, case
+import copy
+import functools
+import itertools
+import json
+import logging
+from typing import Any, Iterable, Type
+
+from sqlalchemy import (
+    asc,
+    desc,
+    and_,
+    select,
+    func,
+    case,
+    bindparam,
+    update,
+    Integer,
+)
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import RelationshipDirection
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.sql.visitors import InternalTraversal
 
 from services.error import SQLGenerationException
 from services.query_parser import (
@@ -11,106 +30,289 @@ from services.query_parser import (
     FilterAction,
     SortAction,
 )
-from services.serialization import BaseSerializer, get_prop_serializer, get_serializer
+from services.serialization import (
+    BaseSerializer,
+    SerializerField,
+    get_prop_serializer,
+    get_serializer,
+)
+
+logger = logging.getLogger(__name__)
 
 EXCLUDE_COLUMN_PREFIX = "!"
 
 WILDCARD = "*"
 
+OFFSET_PARAM = "offset"
+
+LIMIT_PARAM = "limit"
+
+PARENT_IDS_PARAM = "parent_ids"
+
+# Dialects that understand the CTE materialization hint, others (e.g. MySQL)
+# would fail on it
+NOT_MATERIALIZED_DIALECTS = ("sqlite", "postgresql")
+
+
+def _debug_query(q, params: dict[str, Any] | None = None):
+    # Debugging aid only, rendering literal binds is expensive and bypasses the
+    # compiled statement cache. Pass the params returned by get_all.
+    if not (__debug__ and logger.isEnabledFor(logging.DEBUG)):
+        return
+    if params:
+        q = q.params(params)
+    logger.debug(
+        q.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True})
+    )
+
+
+# JSON operations on the aggregated relation, per dialect. SQLite drops the
+# JSON subtype of a value read back from a CTE, so its arrays have to go
+# through json() again or json_object would embed them as strings. SQLite only,
+# the CTEs and get_all aggregate with its json_group_array/json_object and
+# group_concat as well.
+JSON_OPS = {
+    "sqlite": {
+        "array": lambda obj: func.json(obj),
+        "first": lambda obj: func.json_extract(obj, "$[0]"),
+        "empty_array": lambda obj: func.json("[]"),
+    },
+}
+
+
+class RelationAgg(ColumnElement):
+    inherit_cache = True
+    _traverse_internals = [
+        ("kind", InternalTraversal.dp_string),
+        ("obj", InternalTraversal.dp_clauseelement),
+    ]
+
+    def __init__(self, kind: str, obj=None):
+        self.kind = kind
+        self.obj = obj
+
+
+@compiles(RelationAgg)
+def _compile_relation_agg(element: RelationAgg, compiler, **kw):
+    json_ops = JSON_OPS.get(compiler.dialect.name)
+    if json_ops is None:
+        raise SQLGenerationException(
+            f"Unsupported dialect for relation JSON: {compiler.dialect.name}"
+        )
+    return compiler.process(json_ops[element.kind](element.obj), **kw)
+
+
+def _relation_json_fields(
+    relation_name: str, relation_action_tree: ActionTree, sql_relation, rel_cte
+):
+    if relation_action_tree.select is None:
+        return []
+    else_case = None
+    match sql_relation.direction:
+        case RelationshipDirection.ONETOMANY | RelationshipDirection.MANYTOMANY:
+            else_case = RelationAgg("empty_array")
+            agg_fn = RelationAgg("array", rel_cte.c.obj)
+        case RelationshipDirection.MANYTOONE:
+            agg_fn = RelationAgg("first", rel_cte.c.obj)
+        case _:
+            raise SQLGenerationException(
+                f"Unsupported relation type: {sql_relation.direction}"
+            )
+    return [
+        relation_name,
+        case(
+            (rel_cte.c.id.is_not(None), agg_fn),
+            else_=else_case,
+        ),
+    ]
+
 
-def _debug_query(q):
-    from sqlalchemy.dialects import sqlite
+def _use_materialized_json(
+    relation_field: SerializerField, relation_action_tree: ActionTree, sql_relation
+):
+    # The stored JSON holds every field of every related row, so it can only
+    # answer a plain "*" select of the relation
+    return (
+        getattr(relation_field, "materialized_json", None) is not None
+        and sql_relation.direction
+        in (RelationshipDirection.ONETOMANY, RelationshipDirection.MANYTOMANY)
+        and relation_action_tree.select == [WILDCARD]
+        and not relation_action_tree.filters
+        and relation_action_tree.sort is None
+        and not relation_action_tree.relations
+    )
 
-    print(q.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+
+def _materialized_json_fields(
+    relation_name: str, serializer: Type[BaseSerializer], relation_field
+):
+    column = serializer.model.__dict__[relation_field.materialized_json]
+    return [
+        relation_name,
+        case(
+            (column.is_not(None), RelationAgg("array", column)),
+            else_=RelationAgg("empty_array"),
+        ),
+    ]
 
 
 def _resolve_relationships(
     action: ActionTree, serializer: Type[BaseSerializer], id_field
 ):
-    _model_inspect = serializer.get_model_inspection()
-    _fields = []
-    _joins = []
-    for relation_name, relation_action_tree in action.relations.items():
-        relation_src_name = serializer.get_serializer_field(relation_name)
-        sql_relation = _model_inspect.relationships[relation_src_name.field]
-        rel_serializer = get_prop_serializer(serializer.model, relation_src_name.field)
-        _rel_cte = _relation_select(
-            relation_action_tree,
+    # Walk the relation tree with a work queue instead of recursion. The first
+    # pass lists relations parents first and builds their subqueries (nested
+    # filters may add relations to walk), the second one builds the CTEs
+    # children first. Node 0 is the action itself.
+    _extra_hidden_cols = []  # foreign keys of the action that the joins need
+    _relations = [None]  # (name, action, serializer, parent model, sql relation)
+    _subqueries = [None]
+    _children: list[list[int]] = [[]]
+    _materialized_fields: dict[int, list] = {}  # no CTE, read from a column
+    _queue = [(0, action, serializer)]
+    while _queue:
+        parent_index, parent_action, parent_serializer = _queue.pop()
+        for relation_name, relation_action_tree in parent_action.relations.items():
+            relation_src_name, rel_serializer, sql_relation = _relation_descriptor(
+                parent_serializer, relation_name
+            )
+            index = len(_children)
+            _children.append([])
+            _children[parent_index].append(index)
+            if parent_index == 0 and _use_materialized_json(
+                relation_src_name, relation_action_tree, sql_relation
+            ):  # Only the action's own table has the materialized column at hand
+                _materialized_fields[index] = _materialized_json_fields(
+                    relation_name, parent_serializer, relation_src_name
+                )
+                continue
+            if parent_index == 0:
+                this_id_col, _, has_child_id_col, _ = _relation_id_cols(
+                    parent_serializer, sql_relation
+                )
+                if has_child_id_col:
+                    _extra_hidden_cols.append(this_id_col)
+            _relations.append(
+                (
+                    relation_name,
+                    relation_action_tree,
+                    rel_serializer,
+                    parent_serializer.model,
+                    sql_relation,
+                )
+            )
+            _subqueries.append(
+                _relation_select(relation_action_tree, rel_serializer, sql_relation)
+            )
+            _queue.append((index, relation_action_tree, rel_serializer))
+
+    _ctes = [None] * len(_children)
+    for index in range(len(_children) - 1, -1, -1):
+        if index in _materialized_fields:
+            continue
+        node_id_field = id_field if index == 0 else _subqueries[index][0].c.id
+        _fields = []
+        _joins = []
+        for child_index in _children[index]:
+            if child_index in _materialized_fields:
+                _fields.extend(_materialized_fields[child_index])
+                continue
+            relation_name, relation_action_tree, _, _, sql_relation = _relations[
+                child_index
+            ]
+            _rel_cte = _ctes[child_index]
+            _fields.extend(
+                _relation_json_fields(
+                    relation_name, relation_action_tree, sql_relation, _rel_cte
+                )
+            )
+            _joins.append((relation_name, _rel_cte, node_id_field == _rel_cte.c.id))
+        if index == 0:
+            return _fields, _joins, _extra_hidden_cols
+        _, _, rel_serializer, parent_model, sql_relation = _relations[index]
+        _ctes[index] = _relation_cte(
+            _subqueries[index],
             rel_serializer,
-            serializer.model,
+            parent_model,
             sql_relation,
+            _fields,
+            _joins,
         )
-        if relation_action_tree.select is not None:
-            _fields.append(relation_name)
-            else_case = None
-            match sql_relation.direction:
-                case RelationshipDirection.ONETOMANY:
-                    else_case = func.json("[]")
-                    agg_fn = func.json(_rel_cte.c.obj)
-                case RelationshipDirection.MANYTOONE:
-                    agg_fn = func.json_extract(_rel_cte.c.obj, "$[0]")
-                case RelationshipDirection.MANYTOMANY:
-                    else_case = func.json("[]")
-                    agg_fn = func.json(_rel_cte.c.obj)
-                case _:
-                    raise SQLGenerationException(
-                        f"Unsupported relation type: {sql_relation.direction}"
-                    )
-            _fields.append(
-                case(
-                    (_rel_cte.c.id.is_not(None), agg_fn),
-                    else_=else_case,
-                )
+
+
+def _fields_to_select(
+    select_fields: list[str],
+    serializer: Type[BaseSerializer],
+    _select_set: frozenset[str] | None = None,
+):
+    if _select_set is None:  # callers that test the select themselves pass it
+        _select_set = frozenset(select_fields)
+    _exclude_fields = {
+        _field[1:] for _field in _select_set if _field.startswith(EXCLUDE_COLUMN_PREFIX)
+    }  # If we use "!" we store fields that we want to exclude
+    if _exclude_fields:  # Take all fields, but remove with !
+        return [
+            _field
+            for _field in serializer.get_non_relation_fields()
+            if _field.alias not in _exclude_fields
+        ]
+    if WILDCARD in _select_set:  # Get all fields that are in this serializer if "*"
+        return (
+            serializer.get_non_relation_fields()
+        )  # We don`t add relations(navigation properties) to list
+    return [
+        serializer.get_serializer_field(_field)
+        for _field in select_fields  # Take fields that entered by user
+    ]
+
+
+def _json_object_args(
+    field_to_select, serializer: Type[BaseSerializer], get_column
+) -> list:
+    # Alias/column pairs for json_object, a full select reuses the template
+    # precomputed by the serializer
+    if field_to_select is serializer.get_non_relation_fields():
+        template = serializer.get_json_alias_template()
+    else:
+        template = tuple(
+            itertools.chain.from_iterable(
+                (field_def.alias, field_def.field) for field_def in field_to_select
             )
-        _joins.append((relation_name, _rel_cte, id_field == _rel_cte.c.id))
-    return _fields, _joins
+        )
+    args = list(template)
+    args[1::2] = [get_column(field_name) for field_name in template[1::2]]
+    return args
+
+
+def _relation_action(
+    action: ActionTree, relation_name: str, select: list[str] | None
+) -> ActionTree:
+    # Action tree of the relation, created with the given select if the query
+    # doesn't have one (for filtering and sorting by linked entities)
+    rel_action = action.relations.get(relation_name)
+    if rel_action is None:
+        rel_action = ActionTree()
+        rel_action.select = select
+        action.relations[relation_name] = rel_action
+    return rel_action
 
 
 def _json_query(qo: ActionTree, serializer: Type[BaseSerializer]):
     _fields = []
     _joins = []
     _hidden_fields_to_select = []
-    _exclude_fields = []
-    _model_inspect = serializer.get_model_inspection()
-    _wild_select = any((_field == "*" for _field in qo.select))
-    _field_to_select = []
-    if _wild_select:
-        _field_to_select = [
-            _field
-            for _field in serializer.fields
-            if _field.field not in _model_inspect.relationships
-        ]
-    else:
-        _field_to_select = [
-            serializer.get_serializer_field(field_alias)
-            for field_alias in qo.select
-            if not field_alias.startswith("!")
-        ]
+    _select_set = frozenset(qo.select)
+    _field_to_select = _fields_to_select(qo.select, serializer, _select_set)
 
-    for _field in qo.select:
-        if _field.startswith(EXCLUDE_COLUMN_PREFIX):
-            _field_to_select = [
-                _field
-                for _field in serializer.fields
-                if _field.field not in _model_inspect.relationships
-            ]
-            _field_to_select.remove(serializer.get_serializer_field(_field[1:]))
-
-    for field in _field_to_select:
-        _fields.append(field.alias)
-        _fields.append(serializer.get_db_field(field.field))
-    if "id" not in qo.select:
+    _fields.extend(
+        _json_object_args(_field_to_select, serializer, serializer.get_db_field)
+    )
+    if "id" not in _select_set:
         _hidden_fields_to_select.append(serializer.get_db_field("id"))
     _filters = []
     _inner_cte: list[str] = []
     for flt_item in qo.filters:
         if isinstance(flt_item.field, NestedField):
-            if flt_item.field.fields[0] in qo.relations:
-                rel_action = qo.relations[flt_item.field.fields[0]]
-            else:
-                rel_action = ActionTree()
-                rel_action.select = None
-                qo.relations[flt_item.field.fields[0]] = rel_action
+            rel_action = _relation_action(qo, flt_item.field.fields[0], None)
 
             rel_action.filters.append(
                 FilterAction(
@@ -123,26 +325,15 @@ def _json_query(qo: ActionTree, serializer: Type[BaseSerializer]):
             continue
         _filters.append(
             flt_item.operator(
-                serializer.get_db_field(
-                    serializer.get_serializer_field(flt_item.field).field
-                ),
+                serializer.get_db_field_by_alias(flt_item.field),
                 flt_item.value,
             )
         )
-    rel_fields, _joins = _resolve_relationships(qo, serializer, serializer.model.id)
+    rel_fields, _joins, extra_hidden_cols = _resolve_relationships(
+        qo, serializer, serializer.model.id
+    )
     _fields.extend(rel_fields)
-
-    for relation_name, relation_action_tree in qo.relations.items():
-        sql_relation = _model_inspect.relationships[relation_name]
-
-        if sql_relation.primaryjoin.left in _model_inspect.columns.values():
-            this_id_col = sql_relation.primaryjoin.left
-        else:
-            this_id_col = sql_relation.primaryjoin.right
-        has_child_id_col = this_id_col != serializer.model.id
-
-        if has_child_id_col:
-            _hidden_fields_to_select.append(this_id_col)
+    _hidden_fields_to_select.extend(extra_hidden_cols)
     obj = func.json_object(*_fields)
     q = select(obj.label("sql_rest"), *_hidden_fields_to_select)
     for join in _joins:
@@ -159,30 +350,17 @@ def _json_query(qo: ActionTree, serializer: Type[BaseSerializer]):
         field_stack.extend(reversed(qo.sort.field.fields))
         if len(field_stack) == 1:
             q = q.order_by(
-                asc(
-                    serializer.get_db_field(
-                        serializer.get_serializer_field(qo.sort.field.fields[0]).field
-                    )
-                )
+                asc(serializer.get_db_field_by_alias(qo.sort.field.fields[0]))
                 if qo.sort.order is not SortOrder.DESC
-                else desc(
-                    serializer.get_db_field(
-                        serializer.get_serializer_field(qo.sort.field.fields[0]).field
-                    )
-                )
+                else desc(serializer.get_db_field_by_alias(qo.sort.field.fields[0]))
             )
         else:
             while field_stack:
                 current_field = field_stack.pop()
 
-                if current_field in qo.relations:
-                    rel_action = qo.relations[current_field]
-                else:
-                    rel_action = ActionTree()
-                    rel_action.select = None
-                    qo.relations[
-                        current_field
-                    ] = rel_action  # TODO We must remake this, because there are some errors
+                rel_action = _relation_action(
+                    qo, current_field, None
+                )  # TODO We must remake this, because there are some errors
 
                 rel_action.sort = SortAction(
                     field=qo.sort.field.shift_down()
@@ -198,9 +376,7 @@ def _json_query(qo: ActionTree, serializer: Type[BaseSerializer]):
                 else:
                     serializer_entity = get_serializer(serializer.model)
 
-                    db_field = serializer_entity.get_db_field(
-                        serializer_entity.get_serializer_field(current_field).field
-                    )
+                    db_field = serializer_entity.get_db_field_by_alias(current_field)
 
                     order_by_clause = (
                         asc(db_field)
@@ -243,9 +419,9 @@ def _json_query(qo: ActionTree, serializer: Type[BaseSerializer]):
         #         )
         #     )
         # )
-    if qo.offset:
+    if qo.offset is not None:
         q = q.offset(qo.offset)
-    if qo.limit:
+    if qo.limit is not None:
         q = q.limit(qo.limit)
     q = q.group_by(serializer.get_db_field("id"))
     q = q.subquery()
@@ -280,22 +456,25 @@ def _json_query(qo: ActionTree, serializer: Type[BaseSerializer]):
 #     return q, rel_action
 
 
-def _relation_select(
-    action: ActionTree,
-    serializer: Type[BaseSerializer],
-    parent_model,
-    sql_relation,
-):
+@functools.lru_cache(maxsize=1024)
+def _relation_descriptor(serializer: Type[BaseSerializer], relation_name: str):
+    # Serializer field, related serializer and SQL relationship of a relation,
+    # looked up once per serializer and relation name
+    relation_field = serializer.get_serializer_field(relation_name)
+    sql_relation = serializer.get_model_inspection().relationships[relation_field.field]
+    rel_serializer = get_prop_serializer(serializer.model, relation_field.field)
+    return relation_field, rel_serializer, sql_relation
+
+
+@functools.lru_cache(maxsize=1024)
+def _relation_id_cols(serializer: Type[BaseSerializer], sql_relation):
     primaryjoin = sql_relation.primaryjoin
-    fields_into_json = []  # fields that we want to select
-    _joins = []  # for linked entities
-    _cte = None  # Common Table Expression
-    _model_inspect = (
-        serializer.get_model_inspection()
-    )  # Get model from serializer(mapper[Model])
-    if (
-        primaryjoin.left in _model_inspect.columns.values()
-    ):  # Set columns id of linked entities according to type of relation
+    columns_set = serializer.get_columns_set()
+    if primaryjoin.left in columns_set or (
+        primaryjoin.right not in columns_set
+        and primaryjoin.left.table is sql_relation.secondary
+    ):  # Set columns id of linked entities according to type of relation, the
+        # related side of many to many is linked by the secondary table
         parent_id_col = primaryjoin.left
         other_id_col = primaryjoin.right
     else:
@@ -304,40 +483,25 @@ def _relation_select(
     has_parent_id_col = (
         parent_id_col != serializer.model.id
     )  # Check if in linked entity is foreign key for this entity
+    return parent_id_col, other_id_col, has_parent_id_col, sql_relation.direction
+
+
+def _relation_select(
+    action: ActionTree,
+    serializer: Type[BaseSerializer],
+    sql_relation,
+):
+    fields_into_json = []  # fields that we want to select
+    parent_id_col, _, has_parent_id_col, direction = _relation_id_cols(
+        serializer, sql_relation
+    )
     if action.select:  # In action tree check if there are any select for parent entity
-        _exclude_fields = []  # If we use "!" we store fields that we want to exclude
-
-        _wild_select = any(
-            (_field == WILDCARD for _field in action.select)
-        )  # True if "*" in select fields
-        _field_to_select = []
-        if _wild_select:  # Get all fields that are in this serializer if "*"
-            _field_to_select = [
-                _field
-                for _field in serializer.fields
-                if _field.field
-                not in _model_inspect.relationships  # We don`t add it to list if it is relation(navigation property)
-            ]
-        else:  # if something else than all fields *
-            _field_to_select = [
-                serializer.get_serializer_field(_field)
-                for _field in action.select  # Take fields that entered by user
-            ]
-        for _field in action.select:
-            if _field.startswith(EXCLUDE_COLUMN_PREFIX):  # if "!" before field
-                _field_to_select = [
-                    _field
-                    for _field in serializer.fields
-                    if _field.field not in _model_inspect.relationships
-                ]
-                _field_to_select.remove(
-                    serializer.get_serializer_field(_field[1:])
-                )  # Take all fields, but remove with !
+        _field_to_select = _fields_to_select(action.select, serializer)
         fld = set(
             serializer.get_db_field(field.field) for field in _field_to_select
         )  # Get fields such as in DB and provide unique
         if has_parent_id_col:
-            if sql_relation.direction != RelationshipDirection.MANYTOMANY:
+            if direction != RelationshipDirection.MANYTOMANY:
                 fld.add(parent_id_col)  # add to set foreign key
         for flt in action.filters:
             if isinstance(
@@ -345,19 +509,17 @@ def _relation_select(
             ):  # If filter to linked entity, then we don`t anything
                 continue
             fld.add(
-                serializer.get_db_field(
-                    serializer.get_serializer_field(flt.field).field
+                serializer.get_db_field_by_alias(
+                    flt.field
                 )  # Add to set field that we filter by
             )
         fld.add(serializer.get_db_field("id"))  # add id
         q = select(*fld)  # Create query
     else:  # if fields to select are not defined
         q = select(serializer.model)  # query for select certain model
-        _field_to_select = [
-            _field
-            for _field in serializer.fields
-            if _field.field not in _model_inspect.relationships
-        ]  # There all fields are selected
+        _field_to_select = (
+            serializer.get_non_relation_fields()
+        )  # There all fields are selected
 
     if action.sort is not None:  # if order is defined
         col = serializer.get_db_field(
@@ -368,12 +530,11 @@ def _relation_select(
         )  # set order ascending or descending
         q = q.order_by(col)  # Add it to query
     q = q.subquery()  # Make from query subquery to manipulate in future
+    _columns = dict(q.c.items())  # Snapshot of subquery columns by name
 
-    for field_def in _field_to_select or []:
-        fields_into_json.append(field_def.alias)
-        fields_into_json.append(
-            q.c[field_def.field]
-        )  # Add to list elements that we want to select
+    fields_into_json.extend(
+        _json_object_args(_field_to_select, serializer, _columns.__getitem__)
+    )  # Add to list elements that we want to select
 
     filter_items = []
     _inner_cte: list[str] = []
@@ -381,14 +542,9 @@ def _relation_select(
         if isinstance(
             flt_item.field, NestedField
         ):  # If we filter by field in linked entity
-            if (
-                flt_item.field.fields[0] in action.relations
-            ):  # In [0] we have relation and in [1] certain field
-                rel_action = action.relations[flt_item.field.fields[0]]
-            else:
-                rel_action = ActionTree()  # For linked in 2 and more depth filtering
-                rel_action.select = ["id"]
-                action.relations[flt_item.field.fields[0]] = rel_action
+            rel_action = _relation_action(
+                action, flt_item.field.fields[0], ["id"]
+            )  # In [0] we have relation and in [1] certain field
 
             rel_action.filters.append(
                 FilterAction(
@@ -403,17 +559,31 @@ def _relation_select(
             continue  # while nested we do it again and again
         filter_items.append(
             flt_item.operator(
-                q.c[serializer.get_serializer_field(flt_item.field).field],
+                _columns[serializer.get_serializer_field(flt_item.field).field],
                 flt_item.value,
             )  # add operator that we use to filter
         )
 
-    relation_fields_into_json, _joins = _resolve_relationships(
-        action,
-        serializer,
-        q.c.id,
-    )  # get lists that define requests parameters properly(According to relation type, etc.)
-    fields_into_json.extend(relation_fields_into_json)  # fields that we want to select
+    return q, _columns, fields_into_json, filter_items, _inner_cte
+
+
+def _relation_cte(
+    relation_select: tuple,
+    serializer: Type[BaseSerializer],
+    parent_model,
+    sql_relation,
+    relation_fields_into_json: list,
+    _joins: list,
+):
+    q, _columns, fields_into_json, filter_items, _inner_cte = relation_select
+    primaryjoin = sql_relation.primaryjoin
+    parent_id_col, other_id_col, has_parent_id_col, direction = _relation_id_cols(
+        serializer, sql_relation
+    )
+    fields_into_json = [
+        *fields_into_json,
+        *relation_fields_into_json,
+    ]  # fields that we want to select, relation fields come from _resolve_relationships
 
     _cte = select(  # create Common Table Expression
         func.json_group_array(func.json_object(*fields_into_json)).label(
@@ -423,18 +593,18 @@ def _relation_select(
             "id"
         )  # Take id from model if linked model doesn`t have foreign key
         if not has_parent_id_col
-        or sql_relation.direction == RelationshipDirection.MANYTOMANY
-        else q.c[parent_id_col.name].label("id"),  # Take FK if we have it
+        or direction == RelationshipDirection.MANYTOMANY
+        else _columns[parent_id_col.name].label("id"),  # Take FK if we have it
     ).select_from(q)
     # many to many check
 
-    if sql_relation.direction == RelationshipDirection.MANYTOMANY:
+    if direction == RelationshipDirection.MANYTOMANY:
         relation_model_table = (
             primaryjoin.right.table
         )  # First by id cte right table (user_id), second join by second table from right table
         _cte = _cte.join(
             relation_model_table,
-            onclause=sql_relation.secondaryjoin.right == q.c.id,
+            onclause=sql_relation.secondaryjoin.right == _columns["id"],
             isouter=False,
         )
         _cte = _cte.join(
@@ -447,9 +617,9 @@ def _relation_select(
         if not has_parent_id_col:  # else
             _cte = _cte.join(
                 parent_model,
-                onclause=other_id_col == q.c[parent_id_col.name],
+                onclause=other_id_col == _columns[parent_id_col.name],
                 isouter=True,
-            )  # Make join by other_id_col == q.c[parent_id_col.name] if linked model doesn`t have foreign key
+            )  # Make join by other_id_col == _columns[parent_id_col.name] if linked model doesn`t have foreign key
 
     for relation_name, rel_cte, onclause in _joins:
         _cte = _cte.join(
@@ -462,21 +632,281 @@ def _relation_select(
     _cte = _cte.group_by(
         parent_model.id
         if not has_parent_id_col
-        or sql_relation.direction == RelationshipDirection.MANYTOMANY
-        else q.c[parent_id_col.name]
+        or direction == RelationshipDirection.MANYTOMANY
+        else _columns[parent_id_col.name]
     )  # We group by id if there are FK else by parent_id_col.name
 
-    return _cte.cte().prefix_with(
-        "NOT MATERIALIZED"
-    )  # create CTE object, and we want to first compute CTE, then use it
+    # create CTE object, and we want to first compute CTE, then use it
+    _cte = _cte.cte()
+    for dialect in NOT_MATERIALIZED_DIALECTS:
+        _cte = _cte.prefix_with("NOT MATERIALIZED", dialect=dialect)
+    return _cte
+
+
+def _field_shape(field: str | NestedField):
+    return tuple(field.fields) if isinstance(field, NestedField) else field
+
+
+def _field_from_shape(field: str | tuple[str, ...]):
+    return NestedField(field) if isinstance(field, tuple) else field
+
+
+def _action_shape(action: ActionTree, params: dict[str, Any]) -> tuple:
+    # Hashable description of the action tree, filter values are moved to
+    # params and replaced by the names of their bind parameters
+    filters = []
+    for flt_item in action.filters:
+        param_name = f"flt_{len(params)}"
+        params[param_name] = flt_item.value
+        filters.append((_field_shape(flt_item.field), flt_item.operator, param_name))
+    return (
+        action.name,
+        None if action.select is None else tuple(action.select),
+        tuple(filters),
+        None
+        if action.sort is None
+        else (_field_shape(action.sort.field), action.sort.order),
+        tuple(
+            (relation_name, _action_shape(relation_action_tree, params))
+            for relation_name, relation_action_tree in action.relations.items()
+        ),
+    )
+
+
+def _action_from_shape(shape: tuple) -> ActionTree:
+    name, select_fields, filters, sort, relations = shape
+    action = ActionTree()
+    action.name = name
+    action.select = None if select_fields is None else list(select_fields)
+    action.filters = [
+        FilterAction(field=_field_from_shape(field), op=op, value=bindparam(param))
+        for field, op, param in filters
+    ]
+    if sort is not None:
+        action.sort = SortAction(order=sort[1], field=_field_from_shape(sort[0]))
+    action.relations = {
+        relation_name: _action_from_shape(relation_shape)
+        for relation_name, relation_shape in relations
+    }
+    return action
+
+
+@functools.lru_cache(maxsize=512)
+def _cached_json_query(
+    shape: tuple, has_offset: bool, has_limit: bool, serializer: Type[BaseSerializer]
+):
+    # Built once per query shape, values are passed when the query is executed
+    action = _action_from_shape(shape)
+    action.offset = bindparam(OFFSET_PARAM, type_=Integer) if has_offset else None
+    action.limit = bindparam(LIMIT_PARAM, type_=Integer) if has_limit else None
+    return _json_query(action, serializer)
+
+
+def _selectin_select(
+    action: ActionTree, serializer: Type[BaseSerializer], sql_relation
+):
+    # One JSON object per related row, keyed by the id of its parent. Parent
+    # ids are bound to PARENT_IDS_PARAM when the query is executed.
+    fields_into_json = _json_object_args(
+        _fields_to_select(action.select, serializer)
+        if action.select
+        else serializer.get_non_relation_fields(),
+        serializer,
+        serializer.get_db_field,
+    )
+    relation_fields_into_json, _joins, _ = _resolve_relationships(
+        action, serializer, serializer.model.id
+    )
+    fields_into_json.extend(relation_fields_into_json)
+
+    parent_id_col, _, _, direction = _relation_id_cols(serializer, sql_relation)
+    q = select(
+        parent_id_col.label("parent_id"),
+        func.json_object(*fields_into_json).label("obj"),
+    ).select_from(serializer.model)
+    if direction == RelationshipDirection.MANYTOMANY:
+        q = q.join(sql_relation.secondary, onclause=sql_relation.secondaryjoin)
+    for relation_name, rel_cte, onclause in _joins:
+        q = q.join(rel_cte, onclause=onclause, isouter=True)
+    return q.filter(
+        parent_id_col.in_(bindparam(PARENT_IDS_PARAM, expanding=True))
+    ).order_by(serializer.model.id)
+
+
+@functools.lru_cache(maxsize=512)
+def _cached_selectin_select(
+    shape: tuple, serializer: Type[BaseSerializer], relation_name: str
+):
+    _, rel_serializer, sql_relation = _relation_descriptor(serializer, relation_name)
+    return _selectin_select(_action_from_shape(shape), rel_serializer, sql_relation)
+
+
+def _use_selectin(
+    query_options: ActionTree,
+    serializer: Type[BaseSerializer],
+    relation_name: str,
+    relation_action_tree: ActionTree,
+):
+    # Relations that filter or sort their parents need the CTE join
+    relation_field, _, sql_relation = _relation_descriptor(serializer, relation_name)
+    if not getattr(relation_field, "selectin", False):
+        return False
+    if _use_materialized_json(relation_field, relation_action_tree, sql_relation):
+        return False
+    if sql_relation.direction not in (
+        RelationshipDirection.ONETOMANY,
+        RelationshipDirection.MANYTOMANY,
+    ):
+        return False
+    if (
+        relation_action_tree.select is None
+        or relation_action_tree.filters
+        or relation_action_tree.sort is not None
+    ):
+        return False
+    if query_options.sort is not None and isinstance(
+        query_options.sort.field, NestedField
+    ):
+        if query_options.sort.field.fields[0] == relation_name:
+            return False
+    return not any(
+        isinstance(flt_item.field, NestedField)
+        and flt_item.field.fields[0] == relation_name
+        for flt_item in query_options.filters
+    )
+
+
+def _get_json_query(query_options: ActionTree, serializer: Type[BaseSerializer]):
+    params = {}
+    shape = _action_shape(query_options, params)
+    if query_options.offset:
+        params[OFFSET_PARAM] = query_options.offset
+    if query_options.limit:
+        params[LIMIT_PARAM] = query_options.limit
+    json_query = _cached_json_query(
+        shape, bool(query_options.offset), bool(query_options.limit), serializer
+    )
+    return json_query, params
 
 
 def get_all(query_options: ActionTree, serializer: Type[BaseSerializer]):
+    json_query, params = _get_json_query(query_options, serializer)
     query = select(
+        "[" + func.coalesce(func.group_concat(json_query.c.sql_rest), "") + "]"
+    )
+    return query, params
+
+
+def refresh_materialized_json(
+    session,
+    serializer: Type[BaseSerializer],
+    relation_name: str,
+    parent_ids: Iterable[int | None],
+):
+    # Write hook for RelationField(materialized_json=...): stores the "*" JSON of
+    # the relation on the given parent rows, only their related rows are read.
+    # Call it (and commit) after writes to the related table.
+    relation_field, rel_serializer, sql_relation = _relation_descriptor(
+        serializer, relation_name
+    )
+    if getattr(relation_field, "materialized_json", None) is None:
+        raise SQLGenerationException(
+            f"Relation {relation_name} has no materialized JSON column"
+        )
+    parent_id_col, _, _, direction = _relation_id_cols(rel_serializer, sql_relation)
+    if direction not in (
+        RelationshipDirection.ONETOMANY,
+        RelationshipDirection.MANYTOMANY,
+    ):  # _use_materialized_json never reads these
+        raise SQLGenerationException(
+            f"Unsupported relation type for materialized JSON: {direction}"
+        )
+    parent_ids = sorted(set(parent_ids) - {None})
+    if not parent_ids:
+        return
+    rel_action = ActionTree()
+    rel_action.select = [WILDCARD]
+    q, _columns, fields_into_json, filter_items, _inner_cte = _relation_select(
+        rel_action, rel_serializer, sql_relation
+    )
+    parent_id = (
+        serializer.model.id
+        if direction == RelationshipDirection.MANYTOMANY
+        else _columns[parent_id_col.name]
+    )
+    # Used as a derived table, "WITH ... UPDATE" isn't recognized as a write by
+    # pysqlite and would run outside the session transaction
+    rel_json = _relation_cte(
+        (
+            q,
+            _columns,
+            fields_into_json,
+            [*filter_items, parent_id.in_(parent_ids)],
+            _inner_cte,
+        ),
+        rel_serializer,
+        serializer.model,
+        sql_relation,
+        [],
+        [],
+    ).element.subquery()
+    column = serializer.model.__dict__[relation_field.materialized_json]
+    session.execute(
+        update(serializer.model)
+        .where(serializer.model.id.in_(parent_ids))
+        .values(
+            {
+                column: select(rel_json.c.obj)
+                .where(rel_json.c.id == serializer.model.id)
+                .scalar_subquery()
+            }
+        )
+    )
+
+
+def fetch_all(session, query_options: ActionTree, serializer: Type[BaseSerializer]):
+    # Relations marked with RelationField(selectin=True) are loaded with a second
+    # query by parent ids, like SQLAlchemy selectinload, instead of aggregating
+    # every related row into a CTE. Their JSON is stitched into the parents here.
+    selectin_relations = {
+        relation_name: relation_action_tree
+        for relation_name, relation_action_tree in query_options.relations.items()
+        if _use_selectin(query_options, serializer, relation_name, relation_action_tree)
+    }
+    if not selectin_relations:
+        return session.scalar(*get_all(query_options, serializer))
+
+    main_options = copy.copy(query_options)
+    main_options.relations = {
+        relation_name: relation_action_tree
+        for relation_name, relation_action_tree in query_options.relations.items()
+        if relation_name not in selectin_relations
+    }
+    json_query, params = _get_json_query(main_options, serializer)
+    rows = session.execute(select(json_query.c.id, json_query.c.sql_rest), params).all()
+    parent_ids = [row.id for row in rows]
+    objects = [[row.sql_rest[1:-1]] for row in rows]  # JSON object members
+    for relation_name, relation_action_tree in selectin_relations.items():
+        children = {}
+        if parent_ids:
+            sel_params = {}  # filter values of the relation subtree
+            relation_select = _cached_selectin_select(
+                _action_shape(relation_action_tree, sel_params),
+                serializer,
+                relation_name,
+            )
+            for parent_id, obj in session.execute(
+                relation_select, {**sel_params, PARENT_IDS_PARAM: parent_ids}
+            ):
+                children.setdefault(parent_id, []).append(obj)
+        key = json.dumps(relation_name)
+        for parent_id, members in zip(parent_ids, objects):
+            members.append(f"{key}:[{','.join(children.get(parent_id, ()))}]")
+    return (
         "["
-        + func.coalesce(
-            func.group_concat(_json_query(query_options, serializer).c.sql_rest), ""
+        + ",".join(
+            "{" + ",".join(member for member in members if member) + "}"
+            for members in objects
         )
         + "]"
     )
-    return query
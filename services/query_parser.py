@@ -25,6 +25,8 @@ class SortOrder(str, enum.Enum):
 
 
 class ActionTree:
+    __slots__ = ("name", "select", "filters", "sort", "limit", "offset", "relations")
+
     def __init__(self):
         self.name = None
         self.select: list[str] = []
@@ -36,12 +38,19 @@ class ActionTree:
 
 
 class NestedField:
-    def __init__(self, fields: list[str]):
+    __slots__ = ("fields", "_tail")
+
+    def __init__(self, fields: tuple[str, ...]):
         self.fields = fields
+        self._tail = None
 
     def shift_down(self):
-        _rest = self.fields[1:]
-        return _rest[0] if len(_rest) == 1 else NestedField(_rest)
+        # Computed once, filters and sorts descend the same field for every
+        # nested relation they pass through
+        if self._tail is None:
+            _rest = self.fields[1:]
+            self._tail = _rest[0] if len(_rest) == 1 else NestedField(_rest)
+        return self._tail
 
 
 class FilterAction:
@@ -198,7 +207,7 @@ class SelectQueryTransformer(Transformer):
         return action_tree
 
     def nested_field(self, items):
-        return NestedField(list(map(str, items)))
+        return NestedField(tuple(map(str, items)))
 
 
 parser = Lark(grammar, parser="lalr", transformer=SelectQueryTransformer())
@@ -1,6 +1,9 @@
+import functools
+import itertools
 from typing import Any, Type
 
 from sqlalchemy import inspect
+from sqlalchemy.orm import configure_mappers
 
 
 class SerializerField:
@@ -10,33 +13,96 @@ class SerializerField:
 
 
 class RelationField(SerializerField):
-    ...
+    def __init__(
+        self,
+        field: str,
+        alias: str | None,
+        selectin: bool = False,
+        materialized_json: str | None = None,
+    ):
+        super().__init__(field, alias)
+        # Load with a separate query by parent ids instead of a JSON CTE join,
+        # worth it for one-to-many and many-to-many relations with large fanout
+        self.selectin = selectin
+        # Model column holding the precomputed "*" JSON of the relation, kept up
+        # to date with query_parse.refresh_materialized_json
+        self.materialized_json = materialized_json
 
 
 class BaseSerializer:
     model: Any
     fields: list[SerializerField]
+    _by_field: dict[str, SerializerField]
+    _by_alias: dict[str, SerializerField]
 
     @classmethod
     def get_model_inspection(cls):
-        return inspect(cls.model)
+        # The mapper is a per-model singleton, inspect it only once
+        if "_mi_cache" not in cls.__dict__:
+            cls._mi_cache = inspect(cls.model)
+        return cls._mi_cache
+
+    @classmethod
+    def get_columns_set(cls) -> frozenset:
+        if "_columns_set" not in cls.__dict__:
+            cls._columns_set = frozenset(cls.get_model_inspection().columns.values())
+        return cls._columns_set
+
+    @classmethod
+    def get_non_relation_fields(cls) -> tuple[SerializerField, ...]:
+        # Computed on first use, relationships are only known after all
+        # models are imported and the mappers are configured
+        if "_non_relation_fields" not in cls.__dict__:
+            relationships = cls.get_model_inspection().relationships
+            cls._non_relation_fields = tuple(
+                f for f in cls.fields if f.field not in relationships
+            )
+        return cls._non_relation_fields
 
     def __init_subclass__(cls, **kwargs):
+        # Model attributes are resolved on access, backrefs (e.g. ToDo.slaves)
+        # don't exist until the mappers are configured.
+        cls._by_field = {f.field: f for f in cls.fields}
+        cls._by_alias = {f.alias: f for f in cls.fields}
         __serializers__[cls.model] = cls
 
     @classmethod
     def get_db_field(cls, db_field: str):
-        for serializer_field in cls.fields:
-            if serializer_field.field == db_field:
-                return cls.model.__dict__[serializer_field.field]
-        raise Exception(f"Unknown db model field {db_field}")
+        if db_field not in cls._by_field:
+            raise Exception(f"Unknown db model field {db_field}")
+        return cls.model.__dict__[db_field]
+
+    @classmethod
+    def get_json_alias_template(cls) -> tuple[str, ...]:
+        # json_object arguments for all non-relation fields, aliases at even
+        # positions and db field names to substitute with columns at odd ones
+        if "_json_alias_template" not in cls.__dict__:
+            cls._json_alias_template = tuple(
+                itertools.chain.from_iterable(
+                    (f.alias, f.field) for f in cls.get_non_relation_fields()
+                )
+            )
+        return cls._json_alias_template
+
+    @classmethod
+    def get_db_field_by_alias(cls, field_alias: str):
+        if "_db_by_alias" not in cls.__dict__:
+            # Backrefs are only set on the model once the mappers are configured
+            configure_mappers()
+            cls._db_by_alias = {
+                f.alias: cls.model.__dict__[f.field] for f in cls.fields
+            }
+        try:
+            return cls._db_by_alias[field_alias]
+        except KeyError:
+            raise Exception(f"Unknown serializer field {field_alias}")
 
     @classmethod
     def get_serializer_field(cls, field_alias: str):
-        for serializer_field in cls.fields:
-            if serializer_field.alias == field_alias:
-                return serializer_field
-        raise Exception(f"Unknown serializer field {field_alias}")
+        try:
+            return cls._by_alias[field_alias]
+        except KeyError:
+            raise Exception(f"Unknown serializer field {field_alias}")
 
 
 __serializers__: dict[Any, Type[BaseSerializer]] = {}
@@ -46,6 +112,7 @@ def get_serializer(_type) -> Type[BaseSerializer]:
     return __serializers__.get(_type, None)
 
 
+@functools.lru_cache(maxsize=1024)
 def get_prop_serializer(_type, prop: str):
     serializer = get_serializer(_type)
     _mi = serializer.get_model_inspection()
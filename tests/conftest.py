@@ -0,0 +1,56 @@
+import datetime
+import shutil
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _seed(session):
+    from todo_slave.model import ToDoSlave
+    from todo_slave_details.model import ToDoSlaveDetails
+    from todo_user.model import TodoUser
+    from user.model import User
+
+    created_at = datetime.datetime(2023, 10, 12)
+    session.add_all(
+        [
+            # todo 1 has three slaves, 2 and 3 fewer, 4 none, slave 7 no todo
+            ToDoSlave(id=1, comment="s1", created_at=created_at, todo_id=1),
+            ToDoSlave(id=2, comment="s2", created_at=created_at, todo_id=1),
+            ToDoSlave(id=3, comment="s3", created_at=created_at, todo_id=1),
+            ToDoSlave(id=4, comment="s4", created_at=created_at, todo_id=2),
+            ToDoSlave(id=5, comment="s5", created_at=created_at, todo_id=3),
+            ToDoSlave(id=6, comment="s6", created_at=created_at, todo_id=3),
+            ToDoSlave(id=7, comment="s7", created_at=created_at, todo_id=None),
+            ToDoSlaveDetails(id=1, details="d1", todo_slave_id=1),
+            ToDoSlaveDetails(id=2, details="d2", todo_slave_id=2),
+            ToDoSlaveDetails(id=3, details="d5", todo_slave_id=5),
+            User(
+                id=3,
+                fullname="Lviv Name",
+                date_birth=datetime.date(2000, 1, 1),
+                city="Lviv",
+            ),
+        ]
+    )
+    session.flush()
+    session.add_all([TodoUser(todo_id=2, user_id=3), TodoUser(todo_id=4, user_id=3)])
+    session.commit()
+
+
+@pytest.fixture(scope="session")
+def session(tmp_path_factory):
+    # services.db_services opens (and writes to) ToDoDB.db of the working
+    # directory on import, so it is imported only once the copy is in place
+    workdir = tmp_path_factory.mktemp("db")
+    shutil.copy(ROOT / "ToDoDB.db", workdir)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(workdir)
+        import main  # noqa: F401 registers every model
+        from services.db_services import session
+
+        _seed(session)
+        yield session
+        session.close()
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from services.query_parse import _use_selectin, fetch_all, get_all
+from services.query_parser import parse_query
+from services.query_validation import validate_query_options
+
+# fetch_all loads selectin relations with a second query, get_all with a CTE
+ONE_TO_MANY_QUERIES = [
+    "q=(primary_key, slaves(*))",
+    "q=(primary_key, slaves(primary_key, slavedetails(info)))",
+    'q=(primary_key, slaves(primary_key, todo(primary_key, users(*)).filter(users.city="Lviv")))',
+    'q=(primary_key, slaves(primary_key, todo(primary_key, users(*)).filter(users.city="Rivne")))',
+]
+
+MANY_TO_MANY_QUERIES = [
+    "q=(primary_key, users(*))",
+    "q=(primary_key, users(fullname, todos(primary_key)))",
+    'q=(primary_key, users(primary_key, todos(primary_key, slaves(*)).filter(slaves.instruction="s4")))',
+]
+
+
+def _sorted(value):
+    # CTE arrays come in no particular order
+    if isinstance(value, dict):
+        return {key: _sorted(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return sorted(
+            (_sorted(item) for item in value),
+            key=lambda item: json.dumps(item, sort_keys=True),
+        )
+    return value
+
+
+def _assert_selectin_matches_cte(session, serializer, query):
+    query_options = parse_query(query)
+    validate_query_options(query_options, serializer)
+    (relation_name,) = query_options.relations
+    assert _use_selectin(
+        query_options, serializer, relation_name, query_options.relations[relation_name]
+    )
+    cte_query, params = get_all(parse_query(query), serializer)
+    expected = json.loads(session.execute(cte_query, params).scalar())
+    assert any(obj[relation_name] for obj in expected)
+    result = json.loads(fetch_all(session, query_options, serializer))
+    assert _sorted(result) == _sorted(expected)
+
+
+@pytest.mark.parametrize("query", ONE_TO_MANY_QUERIES)
+def test_one_to_many_selectin_matches_cte(session, query):
+    from todo.serializer import ToDoSerializer
+
+    _assert_selectin_matches_cte(session, ToDoSerializer, query)
+
+
+@pytest.mark.parametrize("query", MANY_TO_MANY_QUERIES)
+def test_many_to_many_selectin_matches_cte(session, monkeypatch, query):
+    from todo.serializer import ToDoSerializer
+
+    monkeypatch.setattr(ToDoSerializer.get_serializer_field("users"), "selectin", True)
+    _assert_selectin_matches_cte(session, ToDoSerializer, query)
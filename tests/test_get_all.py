@@ -0,0 +1,43 @@
+import json
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from services.error import SQLGenerationException
+from services.query_parse import _cached_json_query, get_all
+from services.query_parser import parse_query
+
+
+def _primary_keys(session, query):
+    from todo.serializer import ToDoSerializer
+
+    sql_query, params = get_all(parse_query(query), ToDoSerializer)
+    result = json.loads(session.execute(sql_query, params).scalar())
+    return sorted(obj["primary_key"] for obj in result)
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        (
+            ('q=(primary_key).filter(users.city="Lviv")', [2, 4]),
+            ('q=(primary_key).filter(users.city="Rivne")', [1, 3, 4]),
+        ),
+        (("q=(primary_key).limit(1)", [1]), ("q=(primary_key).limit(3)", [1, 2, 3])),
+    ],
+)
+def test_cached_shape_binds_new_values(session, first, second):
+    # Both queries have the same shape, the second reuses the statement
+    (first_query, first_keys), (second_query, second_keys) = first, second
+    assert _primary_keys(session, first_query) == first_keys
+    hits = _cached_json_query.cache_info().hits
+    assert _primary_keys(session, second_query) == second_keys
+    assert _cached_json_query.cache_info().hits == hits + 1
+
+
+def test_other_dialects_are_rejected(session):
+    from todo.serializer import ToDoSerializer
+
+    sql_query, _ = get_all(parse_query("q=(primary_key, users(*))"), ToDoSerializer)
+    with pytest.raises(SQLGenerationException):
+        sql_query.compile(dialect=postgresql.dialect())
@@ -0,0 +1,198 @@
+import json
+
+import pytest
+from sqlalchemy import Column, ForeignKey, Integer, String, Table, create_engine
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+
+from services.error import SQLGenerationException
+from services.query_parse import (
+    WILDCARD,
+    _cached_json_query,
+    _use_materialized_json,
+    get_all,
+    refresh_materialized_json,
+)
+from services.query_parser import ActionTree, SortAction, SortOrder, parse_query
+from services.serialization import BaseSerializer, RelationField, SerializerField
+
+# Models of their own, none of the application's opts in to materialized_json
+Base = declarative_base()
+
+shelf_tag = Table(
+    "shelf_tag",
+    Base.metadata,
+    Column("shelf_id", ForeignKey("shelf.id"), primary_key=True),
+    Column("tag_id", ForeignKey("tag.id"), primary_key=True),
+)
+
+
+class Shelf(Base):
+    __tablename__ = "shelf"
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    books_json = Column(String)
+    tags_json = Column(String)
+    books = relationship("Book", back_populates="shelf")
+    tags = relationship("Tag", secondary=shelf_tag)
+
+
+class Book(Base):
+    __tablename__ = "book"
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    shelf_id = Column(ForeignKey("shelf.id"))
+    shelf = relationship("Shelf", back_populates="books")
+
+
+class Tag(Base):
+    __tablename__ = "tag"
+    id = Column(Integer, primary_key=True)
+    label = Column(String)
+
+
+class ShelfSerializer(BaseSerializer):
+    model = Shelf
+    fields = [
+        SerializerField("id", "primary_key"),
+        SerializerField("name", "name"),
+        RelationField("books", "books", materialized_json="books_json"),
+        RelationField("tags", "tags", materialized_json="tags_json"),
+    ]
+
+
+class BookSerializer(BaseSerializer):
+    model = Book
+    fields = [
+        SerializerField("id", "primary_key"),
+        SerializerField("title", "title"),
+        RelationField("shelf", "shelf"),
+    ]
+
+
+class TagSerializer(BaseSerializer):
+    model = Tag
+    fields = [
+        SerializerField("id", "primary_key"),
+        SerializerField("label", "label"),
+    ]
+
+
+@pytest.fixture(scope="module")
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        tags = [Tag(id=1, label="t1"), Tag(id=2, label="t2")]
+        session.add_all(
+            [
+                Shelf(id=1, name="one", tags=tags),
+                Shelf(id=2, name="two"),
+                Shelf(id=3, name="three", tags=tags[1:]),
+                Book(id=1, title="b1", shelf_id=1),
+                Book(id=2, title="b2", shelf_id=1),
+                Book(id=3, title="b3", shelf_id=2),
+                Book(id=4, title="b4", shelf_id=None),
+            ]
+        )
+        session.flush()
+        for relation_name in ("books", "tags"):
+            refresh_materialized_json(
+                session, ShelfSerializer, relation_name, [1, 2, 3]
+            )
+        session.commit()
+        yield session
+    _cached_json_query.cache_clear()
+
+
+def _sorted(value):
+    # CTE arrays come in no particular order
+    if isinstance(value, dict):
+        return {key: _sorted(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return sorted(
+            (_sorted(item) for item in value),
+            key=lambda item: json.dumps(item, sort_keys=True),
+        )
+    return value
+
+
+def _run(session, query):
+    # Statements are cached by query shape, which doesn't cover materialized_json
+    _cached_json_query.cache_clear()
+    sql_query, params = get_all(parse_query(query), ShelfSerializer)
+    result = json.loads(session.execute(sql_query, params).scalar())
+    return str(sql_query.compile(session.bind)), _sorted(result)
+
+
+def _run_cte(session, monkeypatch, query):
+    for relation_name in ("books", "tags"):
+        relation_field = ShelfSerializer.get_serializer_field(relation_name)
+        monkeypatch.setattr(relation_field, "materialized_json", None)
+    result = _run(session, query)
+    monkeypatch.undo()
+    return result
+
+
+@pytest.mark.parametrize(
+    "query, relation_name",
+    [
+        ("q=(primary_key, books(*))", "books"),  # one to many
+        ("q=(primary_key, name, tags(*))", "tags"),  # many to many
+    ],
+)
+def test_materialized_matches_cte(session, monkeypatch, query, relation_name):
+    column = ShelfSerializer.get_serializer_field(relation_name).materialized_json
+    sql, result = _run(session, query)
+    assert column in sql
+    cte_sql, expected = _run_cte(session, monkeypatch, query)
+    assert column not in cte_sql
+    assert result == expected
+    assert any(obj[relation_name] for obj in result)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        'q=(primary_key, books(*, shelf(name)).filter(shelf.name="one"))',
+        "q=(primary_key, books(*, shelf(name)))",
+        "q=(primary_key, books(title))",
+    ],
+)
+def test_falls_back_to_cte(session, monkeypatch, query):
+    sql, result = _run(session, query)
+    assert "books_json" not in sql
+    assert result == _run_cte(session, monkeypatch, query)[1]
+
+
+def test_sorted_relation_is_not_materialized():
+    relation_action_tree = ActionTree()
+    relation_action_tree.select = [WILDCARD]
+    relation_field = ShelfSerializer.get_serializer_field("books")
+    sql_relation = ShelfSerializer.get_model_inspection().relationships["books"]
+    assert _use_materialized_json(relation_field, relation_action_tree, sql_relation)
+    relation_action_tree.sort = SortAction(SortOrder.DESC, "primary_key")
+    assert not _use_materialized_json(
+        relation_field, relation_action_tree, sql_relation
+    )
+
+
+def test_refresh_only_given_parents(session, monkeypatch):
+    session.add(Book(id=5, title="b5", shelf_id=2))
+    session.flush()
+    refresh_materialized_json(session, ShelfSerializer, "books", [1])
+    _, result = _run(session, "q=(primary_key, books(*))")
+    (stale,) = [obj for obj in result if obj["primary_key"] == 2]
+    assert [book["primary_key"] for book in stale["books"]] == [3]
+    refresh_materialized_json(session, ShelfSerializer, "books", [2])
+    _, result = _run(session, "q=(primary_key, books(*))")
+    assert result == _run_cte(session, monkeypatch, "q=(primary_key, books(*))")[1]
+    session.rollback()
+
+
+def test_refresh_rejects_relations_without_column(session, monkeypatch):
+    with pytest.raises(SQLGenerationException):
+        refresh_materialized_json(session, BookSerializer, "shelf", [1])
+    relation_field = BookSerializer.get_serializer_field("shelf")
+    monkeypatch.setattr(relation_field, "materialized_json", "title")
+    with pytest.raises(SQLGenerationException):  # many to one is never read
+        refresh_materialized_json(session, BookSerializer, "shelf", [1])
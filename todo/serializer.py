@@ -13,6 +13,6 @@ class ToDoSerializer(BaseSerializer):
         SerializerField("worker_fullname", "worker"),
         SerializerField("due_date", "deadline"),
         SerializerField("count", "amount"),
-        RelationField("slaves", "slaves"),
+        RelationField("slaves", "slaves", selectin=True),
         RelationField("users", "users"),
     ]
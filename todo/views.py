@@ -9,7 +9,7 @@ from starlette.responses import Response
 
 from services.db_services import session
 from services.query_parse import (
-    get_all,
+    fetch_all,
 )
 from services.query_validation import validate_query_options
 from services.query_parser import parse_query
@@ -30,8 +30,10 @@ todo_router = APIRouter(
 async def get_todo(request: Request):
     query_options = parse_query(unquote(request.url.query))
     validate_query_options(query_options, ToDoSerializer)
-    q = get_all(query_options, ToDoSerializer)
-    return Response(content=session.scalar(q), media_type="application/json")
+    return Response(
+        content=fetch_all(session, query_options, ToDoSerializer),
+        media_type="application/json",
+    )
 
 
 @todo_router.get("/{todo_id}")
@@ -7,7 +7,7 @@ from sqlalchemy.sql import exists
 from starlette.responses import Response
 
 from services.db_services import session
-from services.query_parse import get_all
+from services.query_parse import fetch_all
 from services.query_validation import validate_query_options
 from services.query_parser import parse_query
 from todo_slave.model import ToDoSlave
@@ -25,8 +25,10 @@ todo_slave_details_router = APIRouter(
 async def get_todo_slave_details(request: Request):
     query_options = parse_query(unquote(request.url.query))
     validate_query_options(query_options, ToDoSlaveDetailsSerializer)
-    q = get_all(query_options, ToDoSlaveDetailsSerializer)
-    return Response(content=session.scalar(q), media_type="application/json")
+    return Response(
+        content=fetch_all(session, query_options, ToDoSlaveDetailsSerializer),
+        media_type="application/json",
+    )
 
 
 @todo_slave_details_router.get("/{todo_slave_id}")
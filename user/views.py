@@ -7,7 +7,7 @@ from sqlalchemy.sql import exists
 from starlette.responses import Response
 
 from services.db_services import session
-from services.query_parse import get_all
+from services.query_parse import fetch_all
 from services.query_validation import validate_query_options
 from services.query_parser import parse_query
 from todo_slave.model import ToDoSlave
@@ -26,8 +26,10 @@ user_router = APIRouter(
 async def get_users(request: Request):
     query_options = parse_query(unquote(request.url.query))
     validate_query_options(query_options, UserSerializer)
-    q = get_all(query_options, UserSerializer)
-    return Response(content=session.scalar(q), media_type="application/json")
+    return Response(
+        content=fetch_all(session, query_options, UserSerializer),
+        media_type="application/json",
+    )
 
 
 @user_router.get("/{user_id}")